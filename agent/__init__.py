@@ -1,3 +1,2 @@
-from agent import *
-
-
+from .agent import *
+from .encoder import *
@@ -41,10 +41,22 @@ class PSAgent:
         Glow_Decay/Dampening (d_g)
             Rate of glow decay
         Associative Groth (k)
+        Layers (l)
+            The number of clip layers in a hierarchical clip network (Briegel & De las Cuevas 2012), 0 keeps every clip connected to every other clip
+            Layer 0 holds the percepts, layers 1 to l-1 hold intermediate/composite clips and the actions follow the last layer
+            Walks hop strictly from one layer to the next so deliberation is set by the number of layers and must be left at 0
+        Layer Widths
+            The number of composite clips in each intermediate layer (one width per layer 1 to l-1), created when the agent is built
+            Percepts connect to the composites of layer 1 so memory and walk cost scale with the widths rather than the number of percepts
+            More composites can be added with add_clip_to_memory(clip, layer=l) and are connected to every clip of the neighbouring layers
+
+    NOTE: Percept Encoder
+        An optional encoder (see encoder.py) maps raw observations to bounded clips before the clip space lookup
+        so that continuous percepts like the color and size of a stimulus share clips instead of adding a new clip every step
     """
     #TODO: use matrix multiplication to speed up the process anywhere possible
 
-    def __init__(self, g_edge=False, g_clip=False, emotion=False, probability_type="traditional", reflection=0, deliberation=0, decay_h=.15, decay_g=0, k=.25, actions = []):
+    def __init__(self, g_edge=False, g_clip=False, emotion=False, probability_type="traditional", reflection=0, deliberation=0, decay_h=.15, decay_g=0, k=.25, layers=0, layer_widths=(), encoder=None, actions = []):
         self.g_edge = g_edge
         self.g_clip = g_clip
         self.emotion = emotion
@@ -55,6 +67,18 @@ class PSAgent:
         self.probability_type = probability_type
         self.k = k
 
+        if layers < 0:
+            raise ValueError("The number of layers can not be negative, got %d" % layers)
+        if layers > 0 and deliberation != 0:
+            raise ValueError("Deliberation is set by the number of layers in a layered network, leave deliberation at 0")
+        if len(layer_widths) != max(layers - 1, 0):
+            raise ValueError("A network with %d layers needs %d layer widths, got %d" % (layers, max(layers - 1, 0), len(layer_widths)))
+        if any(width < 1 for width in layer_widths):
+            raise ValueError("Every intermediate layer needs at least one composite clip, got widths %s" % (layer_widths,))
+        self.layers = layers
+        self.layer_widths = tuple(layer_widths)
+        self.encoder = encoder
+
         self.log_file = "log.txt"
 
         #The memory space of action and percepts is a dictionary of clips because we will be looking up clips frequently (O(1))
@@ -67,6 +91,13 @@ class PSAgent:
         self.clip_action_matrix = np.zeros((3, 1, 1), dtype= float)
         self.__init_action_space(actions)
 
+        #In a layered network each layer has its own clip space and each pair of neighbouring layers its own block matrix
+        #layer_matrices[l] holds the edges from layer l to layer l+1 (or to the actions for the last layer) shaped (3, width_l, width_l+1)
+        self.layer_spaces = []
+        self.layer_matrices = []
+        if self.layers > 0:
+            self.__init_layer_space(len(actions))
+
         self.last_path_taken = [] #A list of the indexes of the clips taken in the last walk
 
     def __init_action_space(self, actions):
@@ -77,10 +108,24 @@ class PSAgent:
         self.clip_action_matrix = np.full((3, 1, len(actions)), 0)
         self.clip_action_matrix[0] = np.full((1, len(actions)), 1)
 
+    def __init_layer_space(self, action_count):
+        self.layer_spaces = [{} for layer in range(self.layers)]
+        self.layer_matrices = [np.zeros((3, 0, 0), dtype= float) for layer in range(self.layers - 1)]
+        self.layer_matrices.append(np.zeros((3, 0, action_count), dtype= float))
+
+        #percepts are looked up in the first layer
+        self.clip_space = self.layer_spaces[0]
+
+        #the intermediate layers start with a fixed pool of composite clips
+        for layer, width in enumerate(self.layer_widths, start=1):
+            for composite in range(width):
+                self.add_layer_clip_to_memory(("composite", composite), layer)
+
     def observe_environment(self, observations=(), reward=0, terminated=False, truncated=False, info={}):
         """
         The agent observes accepts inputs from the environment and processes them
 
+        0. Encode the observations into a clip if the agent has a percept encoder
         1. Check if the clip is in the clip space
             1.1 If it is not in the clip space, add it to the clip space
         2. Get the index of the clip in the clip space
@@ -93,12 +138,13 @@ class PSAgent:
             print("No observations were given to the agent")
             return
         
-        if type(observations) is not tuple or type(observation) is not list:
+        if self.encoder is not None:
+            observations = self.encoder.encode(observations)
+        elif type(observations) is not tuple and type(observations) is not list:
             observations = (observations,)
-            self.observations = observations
         elif type(observations) is list:
             observations = tuple(observations)
-            self.observations = observations
+        self.observations = observations
 
         if tuple(observations) not in self.clip_space:
             self.add_clip_to_memory(clip = self.observations)
@@ -126,108 +172,97 @@ class PSAgent:
         The agent takes an action based on the current state of the environment
         
         percept is the index of the percept in the percept space
-        if deliberation is < 0 then a clip walk will be taken
-        if deliberation is >= 0 then an action from the action space will be taken based on the percept
+        if deliberation and reflection are 0 then an action is drawn straight from the percept
+        otherwise the reflection cycles (with clip walks of deliberation hops) are drawn by reflect
 
         """
-        action_index = 0
-        remaining_jumps = self.deliberation
-        remaining_reflections = self.reflection
-        last_path_taken = []
-        #to use if deliberation is < 0
-        clip_index = percept_index
-        
-        #Couple out immediately if there is no more deliberation and no more reflection
-        if remaining_jumps == 0 and remaining_reflections == 0:
-            action_index, emotion_tag, path_pair = self.get_action(percept_index) #pick an action and observe emotion tag
-            
-            for index in path_pair:
-                last_path_taken.append(index) #add the percept and action to the path taken
+        if self.layers > 0:
+            return self.take_layered_action(percept_index)
 
-            self.log_memory(list(self.action_space.keys())[action_index], last_path_taken)
-            return action_index, last_path_taken
+        #Couple out immediately if there is no deliberation and no reflection
+        if self.deliberation == 0 and self.reflection == 0:
+            action_index, emotion_tag, last_path_taken = self.get_action(percept_index) #pick an action and observe emotion tag
+        #Otherwise draw every reflection walk at once and take the first one ending on a positive emotion
+        else:
+            action_index, last_path_taken = self.reflect(percept_index)
 
-        elif remaining_jumps > 0 and remaining_reflections == 0:
-            #see if there is a positive emotion on the action chosen by percept
-            action_index, emotion_tag, path_pair = self.get_action(percept_index) #pick an action and observe emotion tag
-            
-            for index in path_pair:
-                    last_path_taken.append(index)
-            
-            if emotion_tag:
-                #if there is a positive emotion then we will take the action
-                self.log_memory(list(self.action_space.keys())[action_index], last_path_taken)
-                return action_index, last_path_taken
-            else:
-                last_path_taken.pop() #remove the action from the path taken
-                clip_index = last_path_taken[-1]
+        self.log_memory(list(self.action_space.keys())[action_index], last_path_taken)
+        return action_index, last_path_taken
 
-            #Take only one clip walk after checking if initial percept has a +emotion action (because there is no reflection)
-            while remaining_jumps > 0:
-                clip_index = np.random.choice(list(self.clip_space.values()), p=self.get_clip_probabilities(clip_index))
-                last_path_taken.append(clip_index)
+    def reflect(self, percept_index):
+        """
+        Draws all reflection walks for a percept in one pass, one row per reflection cycle
 
-                remaining_jumps -= 1
+        Each cycle first picks an action straight from the percept and, if that action has no positive emotion and there is
+        deliberation, walks d hops from the percept and picks an action at the end clip
+        The first cycle that ends on a positive emotion is taken, otherwise the last cycle is taken
+        The cycles do not change the weights so drawing them together gives the same choices as running them one after another
+        With a single clip there is nowhere to walk so only the direct percept to action draw is used
+        """
+        samples = max(self.reflection, 1)
+        walking = self.deliberation > 0 and len(self.clip_space) > 1
+        percepts = np.full(samples, percept_index)
 
-                if remaining_jumps == 0:
-                    action_index, emotion_tag, path_pair = self.get_action(clip_index) #pick an action
+        first_actions = self.draw_indices(self.get_action_probabilities(percepts))
+        successes = self.clip_action_matrix[1, percepts, first_actions] == 1
+        first_successes = successes
 
-                    last_path_taken.append(action_index)
+        if walking:
+            walks = np.empty((samples, self.deliberation + 1), dtype= int)
+            walks[:, 0] = percepts
+            for hop in range(1, self.deliberation + 1):
+                walks[:, hop] = self.draw_indices(self.get_clip_probabilities(walks[:, hop - 1]))
 
-                    self.log_memory(list(self.action_space.keys())[action_index], last_path_taken)
-                    return action_index, last_path_taken
-        #If there is reflection
-        else:
-            while remaining_reflections > 0:
-                #see if there is a positive emotion on the action chosen by percept
-                action_index, emotion_tag, path_pair = self.get_action(percept_index) #pick an action and observe emotion tag
-                
-                for index in path_pair:
-                        last_path_taken.append(index)
-                
-                remaining_reflections -= 1  
-
-                if emotion_tag:
-                    #if there is a positive emotion then we will take the action
-                    self.log_memory(list(self.action_space.keys())[action_index], last_path_taken)
-                    return action_index, last_path_taken                   
-                elif remaining_jumps != 0: #there are jumps left
-                    last_path_taken.pop() #remove the action from the path taken
-                    clip_index = last_path_taken[-1]
-
-                    #take a clip walk if we have jumps
-                    while remaining_jumps > 0:
-                        clip_index = np.random.choice(list(self.clip_space.values()), p=self.get_clip_probabilities(clip_index))
-                        last_path_taken.append(clip_index)
-
-                        remaining_jumps -= 1
-                    
-                    #get an action for our end clip
-                    action_index, emotion_tag, path_pair = self.get_action(clip_index) #pick an action and observe emotion tag
-                    
-                    last_path_taken.append(action_index)
-
-                    if emotion_tag:
-                        #if there is a positive emotion then we will take the action
-                        self.log_memory(list(self.action_space.keys())[action_index], last_path_taken)
-                        return action_index, last_path_taken
-                    if remaining_reflections == 0:
-                        self.log_memory(list(self.action_space.keys())[action_index], last_path_taken)
-                        return action_index, last_path_taken
-                    else:
-                        last_path_taken = []#reset and try again
-                        remaining_jumps = self.deliberation
-                elif remaining_reflections > 0: #there are no jumps left but there are reflections left
-                    last_path_taken = []
-                    remaining_jumps = self.deliberation
-                else: #if there are no reflections left and no jumps left then we will take the action chosen by the percept
-                    self.log_memory(list(self.action_space.keys())[action_index], last_path_taken)
-                    return action_index, last_path_taken
-                    
-
-    def add_clip_to_memory(self, clip = ()):
+            end_actions = self.draw_indices(self.get_action_probabilities(walks[:, -1]))
+            successes = first_successes | (self.clip_action_matrix[1, walks[:, -1], end_actions] == 1)
+
+        successful_cycles = np.flatnonzero(successes)
+        cycle = successful_cycles[0] if len(successful_cycles) > 0 else samples - 1
+
+        if first_successes[cycle] or not walking:
+            return int(first_actions[cycle]), [percept_index, int(first_actions[cycle])]
+
+        return int(end_actions[cycle]), walks[cycle].tolist() + [int(end_actions[cycle])]
+
+    def take_layered_action(self, percept_index):
+        """
+        The agent takes an action by walking through the clip layers starting at the percept
+
+        Each hop only draws from the next layer's block so the cost of a walk scales with the layer widths
+        With reflection the first walk whose edge into the action carries a positive emotion is taken, otherwise the last walk
+        """
+        samples = max(self.reflection, 1)
+
+        #draw the walks of every reflection at once, one row per reflection
+        walks = np.empty((samples, self.layers + 1), dtype= int)
+        walks[:, 0] = percept_index
+
+        for layer in range(self.layers):
+            if self.layer_matrices[layer].shape[2] == 0:
+                raise ValueError("Layer %d has nothing to hop to, add clips to layer %d first" % (layer, layer + 1))
+
+            walks[:, layer + 1] = self.draw_indices(self.get_layer_probabilities(layer, walks[:, layer]))
+
+        #the last hop of the walk is the action
+        successes = np.flatnonzero(self.layer_matrices[-1][1, walks[:, -2], walks[:, -1]] == 1)
+        reflection = successes[0] if len(successes) > 0 else samples - 1
+
+        last_path_taken = walks[reflection].tolist()
+        action_index = last_path_taken[-1]
+
+        self.log_memory(list(self.action_space.keys())[action_index], last_path_taken)
+        return action_index, last_path_taken
+
+    def add_clip_to_memory(self, clip = (), layer = 0):
         if type(clip) != tuple:
             clip = tuple(clip)
+
+        if self.layers > 0:
+            self.add_layer_clip_to_memory(clip, layer)
+            return
+        elif layer != 0:
+            raise ValueError("Clips can only be added to layer %d in a layered network, the agent has no layers" % layer)
+
         #Add the clip to the clip space
         self.clip_space[clip] = self.clip_index
         self.clip_index += 1
@@ -259,13 +294,41 @@ class PSAgent:
             self.clip_action_matrix = np.append(self.clip_action_matrix, np.full((3, 1, self.clip_action_matrix.shape[2]), 0.0), axis=1)
             self.clip_action_matrix[0, action_row_index:, :] = 1.0
 
+    def add_layer_clip_to_memory(self, clip: tuple, layer: int):
+        """
+        Adds a clip to one layer of the layered clip network
+            A row is added to the block leaving the layer and a column to the block entering it, both with h=1
+        """
+        if layer < 0 or layer >= self.layers:
+            raise ValueError("Layer %d does not exist, the agent has %d layers" % (layer, self.layers))
+
+        layer_space = self.layer_spaces[layer]
+        layer_space[clip] = len(layer_space)
+
+        outgoing_matrix = self.layer_matrices[layer]
+        outgoing_row = np.full((3, 1, outgoing_matrix.shape[2]), 0.0)
+        outgoing_row[0] = 1.0
+        self.layer_matrices[layer] = np.append(outgoing_matrix, outgoing_row, axis=1)
+
+        if layer > 0:
+            incoming_matrix = self.layer_matrices[layer - 1]
+            incoming_column = np.full((3, incoming_matrix.shape[1], 1), 0.0)
+            incoming_column[0] = 1.0
+            self.layer_matrices[layer - 1] = np.append(incoming_matrix, incoming_column, axis=2)
+
     def add_action_to_memory(self, action):
         self.action_space[action] = self.action_index
         self.action_index += 1
 
         self.clip_action_matrix = np.append(self.clip_action_matrix, np.full((3, self.clip_action_matrix.shape[1], 1), 0.0), axis=2)
 
-        self.clip_action_matrix[0, :, self.action_index] = 1.0
+        self.clip_action_matrix[0, :, self.action_index - 1] = 1.0
+
+        if self.layers > 0:
+            action_matrix = self.layer_matrices[-1]
+            action_column = np.full((3, action_matrix.shape[1], 1), 0.0)
+            action_column[0] = 1.0
+            self.layer_matrices[-1] = np.append(action_matrix, action_column, axis=2)
 
     def update_weights(self, percept_indices: list, action_index: int, reward: float):
         """
@@ -285,6 +348,10 @@ class PSAgent:
         if type(reward) != float:
             reward = float(reward)
 
+        if self.layers > 0:
+            self.update_layer_weights(percept_indices, action_index, reward)
+            return
+
         if not self.g_edge and not self.g_clip:
             #NOTE: Using mautner et. al 2015 weight updates, it is more readable. Adapting with Briegel et al. 2012's use of k for the indirect walk
             clip_decay_matrix = self.decay_h * (self.clip_clip_matrix[0] - 1)
@@ -338,12 +405,35 @@ class PSAgent:
             #clip glow
             pass
         
+    def update_layer_weights(self, percept_indices: list, action_index: int, reward: float):
+        """
+        Update the block matrices of the layered clip network
+            Every block is decayed and the emotion is set on the edge into the action
+            As in the flat walk the edge leaving the percept gets the full reward and the later hops get k * reward
+        """
+        path = percept_indices + [action_index]
+
+        for layer in range(self.layers):
+            layer_matrix = self.layer_matrices[layer]
+            layer_matrix[0] = layer_matrix[0] - self.decay_h * (layer_matrix[0] - 1)
+
+            if layer == 0:
+                layer_matrix[0, path[layer], path[layer + 1]] += reward
+            else:
+                layer_matrix[0, path[layer], path[layer + 1]] += self.k * reward
+
+        #update the emotion matrix
+        self.layer_matrices[-1][1, path[-2], :] *= 0
+        if reward > 0:
+            self.layer_matrices[-1][1, path[-2], action_index] = 1
+
     def get_action_probabilities(self, percept_index: int):
         """
         Returns the probabilities of each action given a percept uses the type of probability to determine how to calculate the probabilities
+        An array of indices gives one row of probabilities per index
         """
         if self.probability_type == "traditional":
-            action_probabilities = self.clip_action_matrix[0, percept_index, :]/sum(self.clip_action_matrix[0, percept_index, :])
+            action_probabilities = self.clip_action_matrix[0, percept_index, :]/np.sum(self.clip_action_matrix[0, percept_index, :], axis=-1, keepdims=True)
         
         #TODO: add softmax
         elif self.probability_type == "softmax":
@@ -354,9 +444,10 @@ class PSAgent:
     def get_clip_probabilities(self, percept_index: int):
         """
         Returns the probabilities of each clip given a percept uses the type of probability to determine how to calculate the probabilities
+        An array of indices gives one row of probabilities per index
         """
         if self.probability_type == "traditional":
-            clip_probabilities = self.clip_clip_matrix[0, percept_index, :]/sum(self.clip_clip_matrix[0, percept_index, :])
+            clip_probabilities = self.clip_clip_matrix[0, percept_index, :]/np.sum(self.clip_clip_matrix[0, percept_index, :], axis=-1, keepdims=True)
         
         #TODO: add softmax
         elif self.probability_type == "softmax":
@@ -364,6 +455,36 @@ class PSAgent:
 
         return clip_probabilities
 
+    def get_layer_probabilities(self, layer: int, clip_index: int):
+        """
+        Returns the probabilities of each clip (or action) in the next layer given a clip in the current layer
+        An array of indices gives one row of probabilities per index
+        """
+        if self.probability_type == "traditional":
+            layer_probabilities = self.layer_matrices[layer][0, clip_index, :]/np.sum(self.layer_matrices[layer][0, clip_index, :], axis=-1, keepdims=True)
+        else:
+            raise ValueError("Layered networks only support traditional probabilities, got %s" % self.probability_type)
+
+        return layer_probabilities
+
+    def draw_indices(self, probabilities):
+        """
+        Draws one index from every row of a matrix of probabilities at once
+            Like np.random.choice the rows must be finite, non-negative and sum to more than 0
+        """
+        invalid_rows = np.flatnonzero(~np.all(np.isfinite(probabilities) & (probabilities >= 0), axis=1))
+        if len(invalid_rows) > 0:
+            raise ValueError("Probabilities must be finite and non-negative, row %d is not" % invalid_rows[0])
+
+        empty_rows = np.flatnonzero(np.sum(probabilities, axis=1) <= 0)
+        if len(empty_rows) > 0:
+            raise ValueError("Every row of probabilities must sum to more than 0, row %d does not" % empty_rows[0])
+
+        cumulative_probabilities = np.cumsum(probabilities, axis=1)
+        draws = np.random.random((probabilities.shape[0], 1)) * cumulative_probabilities[:, -1:]
+
+        return np.minimum((cumulative_probabilities <= draws).sum(axis=1), probabilities.shape[1] - 1)
+
     def get_action(self, percept_index: int):
         """
         Returns the action to be taken given a percept
@@ -389,14 +510,22 @@ class PSAgent:
         Logs the memory of the agent
         """
         log = open(file=self.log_file, mode="a")
-        log.write("\nClips:\n")
-        log.write(str(self.clip_space))
-        log.write("\nActions:\n")
-        log.write(str(self.action_space))
-        log.write("\nPercept H Matrix:\n")
-        log.write(str(self.clip_clip_matrix))
-        log.write("\nAction H Matrix:\n")
-        log.write(str(self.clip_action_matrix))
+        if self.layers > 0:
+            log.write("\nLayer Clips:\n")
+            log.write(str(self.layer_spaces))
+            log.write("\nActions:\n")
+            log.write(str(self.action_space))
+            log.write("\nLayer H Matrices:\n")
+            log.write(str(self.layer_matrices))
+        else:
+            log.write("\nClips:\n")
+            log.write(str(self.clip_space))
+            log.write("\nActions:\n")
+            log.write(str(self.action_space))
+            log.write("\nPercept H Matrix:\n")
+            log.write(str(self.clip_clip_matrix))
+            log.write("\nAction H Matrix:\n")
+            log.write(str(self.clip_action_matrix))
 
         log.write("\nObservation:\n")
         log.write(str(self.observations))
@@ -0,0 +1,122 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+# Percept encoders that turn raw (possibly continuous) observations into bounded clip ids before the clip space lookup
+class PerceptEncoder(ABC):
+    """
+    Base class for the percept encoders
+
+    NOTE: Encoding
+        encode_batch takes a batch of raw observations shaped (observations, features) and returns one row of codes per observation
+        encode takes a single raw observation (e.g. the color and size of a stimulus) and returns its codes as a tuple to use as a clip
+        Encoded observations are memoized so repeated observations only cost a dictionary lookup
+
+    NOTE: Scalar Values
+        Low/High
+            The lower and upper bound of every feature, values outside are clipped to the bounds
+            A feature with equal bounds (e.g. a constant color channel) always falls in bin 0
+        Bins
+            The number of bins per feature
+        Cache Size
+            The number of encoded observations kept in the memo, the oldest is dropped once it is full, 0 turns memoizing off
+    """
+
+    def __init__(self, low, high, bins=10, cache_size=10000):
+        self.low = np.atleast_1d(np.asarray(low, dtype= float))
+        self.high = np.atleast_1d(np.asarray(high, dtype= float))
+        self.bins = np.broadcast_to(np.atleast_1d(np.asarray(bins, dtype= int)), self.low.shape)
+
+        if np.any(self.high < self.low):
+            raise ValueError("Every high bound must be at least its low bound, got low=%s high=%s" % (self.low, self.high))
+        if np.any(self.bins < 1):
+            raise ValueError("Every feature needs at least one bin, got %s" % self.bins)
+        if cache_size < 0:
+            raise ValueError("The cache size can not be negative, got %d" % cache_size)
+
+        #zero width features are divided by 1 so their clipped value always lands in bin 0
+        self.width = np.where(self.high > self.low, (self.high - self.low) / self.bins, 1.0)
+
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def encode(self, observation):
+        """
+        Returns the clip for a single raw observation, memoized on the flattened observation
+        """
+        if np.isscalar(observation):
+            observation = (observation,)
+        features = tuple(np.hstack(observation).astype(float))
+
+        if features in self.cache:
+            return self.cache[features]
+
+        clip = tuple(int(code) for code in self.encode_batch(np.asarray([features]))[0])
+
+        if self.cache_size > 0:
+            if len(self.cache) >= self.cache_size:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[features] = clip
+
+        return clip
+
+    @abstractmethod
+    def encode_batch(self, observations):
+        """
+        Returns one row of codes per observation in a batch of raw observations shaped (observations, features)
+        """
+
+    def get_bins(self, observations):
+        """
+        Returns the bin of every feature of every observation
+        """
+        observations = np.asarray(observations, dtype= float)
+        if not np.all(np.isfinite(observations)):
+            raise ValueError("Observations must be finite, got %s" % observations)
+
+        observations = np.clip(observations, self.low, self.high)
+        bins = np.floor((observations - self.low) / self.width).astype(int)
+
+        #the upper bound belongs to the last bin
+        return np.minimum(bins, self.bins - 1)
+
+    def clear_cache(self):
+        self.cache = {}
+
+
+class UniformBinEncoder(PerceptEncoder):
+    """
+    Splits every feature into evenly sized bins, the clip is the bin of every feature
+    """
+
+    def encode_batch(self, observations):
+        return self.get_bins(observations)
+
+
+class HashedBucketEncoder(PerceptEncoder):
+    """
+    Hashes the uniform bins of an observation into a fixed number of buckets
+        Keeps the clip space bounded by buckets no matter how many features or bins there are
+    """
+
+    def __init__(self, low, high, bins=10, buckets=1024, cache_size=10000):
+        super().__init__(low, high, bins=bins, cache_size=cache_size)
+
+        if buckets < 1:
+            raise ValueError("There must be at least one bucket, got %d" % buckets)
+        self.buckets = buckets
+
+        #strides that pack the bins of an observation into a single index
+        self.bin_strides = np.cumprod(np.append(1, self.bins[:-1])).astype(np.uint64)
+
+    def encode_batch(self, observations):
+        packed = self.get_bins(observations).astype(np.uint64) @ self.bin_strides
+
+        #splitmix64 finalizer (multiply-xorshift) so neighbouring bins land in unrelated buckets, uint64 arithmetic wraps around
+        packed ^= packed >> np.uint64(30)
+        packed *= np.uint64(0xbf58476d1ce4e5b9)
+        packed ^= packed >> np.uint64(27)
+        packed *= np.uint64(0x94d049bb133111eb)
+        packed ^= packed >> np.uint64(31)
+
+        return (packed % np.uint64(self.buckets)).astype(np.int64)[:, None]
@@ -0,0 +1,85 @@
+import numpy as np
+from collections import Counter
+from agent import PSAgent
+
+# Seeded checks that drawing the reflection cycles at once (PSAgent.reflect) chooses like running them one after another
+samples = 10000
+
+def build_agent(reflection, deliberation):
+    agent = PSAgent(actions=["+", "-", "0"], reflection=reflection, deliberation=deliberation)
+    #the log writes every matrix on each action, keep it out of these checks
+    agent.log_memory = lambda action, path: None
+    for clip in ["a", "b", "c", "d"]:
+        agent.add_clip_to_memory(clip=[clip])
+
+    rng = np.random.RandomState(1)
+    agent.clip_clip_matrix[0] = rng.rand(4, 4) + .1
+    for i in range(4):
+        agent.clip_clip_matrix[0, i, i] = 0.0
+    agent.clip_action_matrix[0] = rng.rand(4, 3) + .1
+
+    #positive emotions on a few end edges so some cycles stop early
+    agent.clip_action_matrix[1, 0, 2] = 1
+    agent.clip_action_matrix[1, 2, 1] = 1
+    agent.clip_action_matrix[1, 3, 0] = 1
+    return agent
+
+def sequential_reflection(agent, percept_index):
+    """
+    The reflection loop run one cycle after another, one np.random.choice per hop
+    """
+    def draw_action(clip_index):
+        action_index = np.random.choice(len(agent.action_space), p=agent.get_action_probabilities(clip_index))
+        return action_index, agent.clip_action_matrix[1, clip_index, action_index] == 1
+
+    for cycle in range(max(agent.reflection, 1)):
+        action_index, emotion_tag = draw_action(percept_index)
+        path = [percept_index, action_index]
+        if emotion_tag:
+            return path
+
+        if agent.deliberation > 0:
+            path = [percept_index]
+            clip_index = percept_index
+            for hop in range(agent.deliberation):
+                clip_index = np.random.choice(len(agent.clip_space), p=agent.get_clip_probabilities(clip_index))
+                path.append(clip_index)
+
+            action_index, emotion_tag = draw_action(clip_index)
+            path.append(action_index)
+            if emotion_tag:
+                return path
+
+    return path
+
+def path_frequencies(draw):
+    paths = Counter(tuple(int(index) for index in draw()) for sample in range(samples))
+    return {path: count / samples for path, count in paths.items()}
+
+def test_reflect_matches_sequential_loop():
+    for reflection, deliberation in [(3, 2), (0, 2), (4, 0), (1, 1)]:
+        agent = build_agent(reflection, deliberation)
+
+        np.random.seed(0)
+        expected = path_frequencies(lambda: sequential_reflection(agent, 0))
+        np.random.seed(0)
+        drawn = path_frequencies(lambda: agent.take_action(0)[1])
+
+        for path in set(expected) | set(drawn):
+            assert abs(expected.get(path, 0) - drawn.get(path, 0)) < .02, (reflection, deliberation, path)
+
+def test_single_clip_draws_action_directly():
+    agent = PSAgent(actions=["+", "-"], reflection=2, deliberation=2)
+    #the log writes every matrix on each action, keep it out of these checks
+    agent.log_memory = lambda action, path: None
+    agent.add_clip_to_memory(clip=["a"])
+
+    np.random.seed(0)
+    for sample in range(100):
+        action_index, path = agent.take_action(0)
+        assert path == [0, action_index]
+
+if __name__ == "__main__":
+    test_reflect_matches_sequential_loop()
+    test_single_clip_draws_action_directly()
+    print("reflection checks passed")